@@ -1,26 +1,303 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import pdfplumber
+from fastapi.responses import ORJSONResponse
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import pypdfium2 as pdfium
 import io
 import os
 from docx import Document
-from tempfile import NamedTemporaryFile
 from dotenv import load_dotenv
+from datetime import timedelta
 import google.generativeai as genai
-import requests
-import json
+import asyncio
+import anyio
+import anyio.to_thread
+import httpx
+import orjson
 import re
 from hubspot import HubSpot
 from hubspot.crm.properties import PropertyCreate
 from hubspot.crm.contacts import (
-    PublicObjectSearchRequest, Filter, FilterGroup,
-    SimplePublicObjectInputForCreate, SimplePublicObjectInput
+    BatchReadInputSimplePublicObjectId, SimplePublicObjectId,
+    BatchInputSimplePublicObjectBatchInput, SimplePublicObjectBatchInput,
+    BatchInputSimplePublicObjectBatchInputForCreate, SimplePublicObjectInputForCreate,
+    SimplePublicObjectInput
 )
 
 load_dotenv()
 
-app = FastAPI()
+class GeminiBatcher:
+    """Batch Gemini calls from concurrent requests into one dispatch window.
+
+    Endpoints submit a prompt and await its future; a background loop drains
+    up to max_batch_size prompts (or whatever arrived within max_delay
+    seconds) and fires them together with generate_content_async +
+    asyncio.gather, so N simultaneous resumes share one RPC window instead
+    of each paying full call latency.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_delay=0.1):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._server_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, prompt, generation_config=None):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((prompt, generation_config, future))
+        return await future
+
+    async def _server_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            results = await asyncio.gather(
+                *[
+                    self.model.generate_content_async(prompt, generation_config=cfg)
+                    for prompt, cfg, _ in batch
+                ],
+                return_exceptions=True,
+            )
+            for (_, _, future), result in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+class HubspotBatcher:
+    """Coalesce contact upserts into HubSpot batch API calls.
+
+    Endpoints submit (email, properties) and await the contact id; a loop
+    flushes up to 100 pending contacts (HubSpot's batch limit) or whatever
+    arrived within max_delay seconds, issuing one batch read by email, one
+    batch update and one batch create instead of 2-3 round-trips per resume.
+    """
+
+    def __init__(self, max_batch_size=100, max_delay=0.2):
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.queue = asyncio.Queue()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._server_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, email, properties):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((email, properties, future))
+        return await future
+
+    async def _server_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        # Dedupe by email so one flush never creates the same contact twice;
+        # the latest submission's properties win. Keys are lowercased to
+        # match HubSpot, which stores contact emails lowercased - otherwise
+        # a mixed-case email never matches the batch-read result and the
+        # flush attempts a duplicate create.
+        pending = {}
+        for email, properties, future in batch:
+            key = email.strip().lower()
+            futures, props = pending.setdefault(key, ([], {}))
+            futures.append(future)
+            props.update(properties)
+
+        try:
+            read_input = BatchReadInputSimplePublicObjectId(
+                id_property="email",
+                inputs=[SimplePublicObjectId(id=email) for email in pending],
+                properties=["email"],
+            )
+            read_res = await run_blocking(
+                hubspot_client.crm.contacts.batch_api.read,
+                batch_read_input_simple_public_object_id=read_input,
+            )
+            found = {res.properties["email"]: res.id for res in read_res.results}
+
+            updates = [
+                SimplePublicObjectBatchInput(id=found[email], properties=props)
+                for email, (_, props) in pending.items() if email in found
+            ]
+            creates = [
+                SimplePublicObjectInputForCreate(properties={**props, "email": email})
+                for email, (_, props) in pending.items() if email not in found
+            ]
+
+            if updates:
+                await run_blocking(
+                    hubspot_client.crm.contacts.batch_api.update,
+                    batch_input_simple_public_object_batch_input=BatchInputSimplePublicObjectBatchInput(inputs=updates),
+                )
+            if creates:
+                create_res = await run_blocking(
+                    hubspot_client.crm.contacts.batch_api.create,
+                    batch_input_simple_public_object_batch_input_for_create=BatchInputSimplePublicObjectBatchInputForCreate(inputs=creates),
+                )
+                for res in create_res.results:
+                    found[res.properties["email"]] = res.id
+
+            for email, (futures, _) in pending.items():
+                for future in futures:
+                    if not future.done():
+                        future.set_result(found.get(email))
+        except Exception:
+            # HubSpot batch calls are atomic, so one bad contact (or a
+            # transient failure) would otherwise 500 every request in the
+            # flush window. Retry per contact so errors stay with the
+            # resume that caused them.
+            for email, (futures, props) in pending.items():
+                try:
+                    contact_id = await self._upsert_one(email, props)
+                except Exception as exc:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(exc)
+                else:
+                    for future in futures:
+                        if not future.done():
+                            future.set_result(contact_id)
+
+    async def _upsert_one(self, email, props):
+        """Per-contact fallback used when a batch call fails."""
+        read_res = await run_blocking(
+            hubspot_client.crm.contacts.batch_api.read,
+            batch_read_input_simple_public_object_id=BatchReadInputSimplePublicObjectId(
+                id_property="email",
+                inputs=[SimplePublicObjectId(id=email)],
+                properties=["email"],
+            ),
+        )
+        if read_res.results:
+            contact_id = read_res.results[0].id
+            await run_blocking(
+                hubspot_client.crm.contacts.basic_api.update,
+                contact_id,
+                simple_public_object_input=SimplePublicObjectInput(properties=props),
+            )
+            return contact_id
+        created = await run_blocking(
+            hubspot_client.crm.contacts.basic_api.create,
+            simple_public_object_input_for_create=SimplePublicObjectInputForCreate(
+                properties={**props, "email": email}
+            ),
+        )
+        return created.id
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global model, hubspot_client
+    if not HUBSPOT_TOKEN:
+        raise RuntimeError("HUBSPOT_TOKEN is not set")
+    # Shared HTTP client (keep-alive + HTTP/2, auth set once) and a bounded
+    # thread pool for the blocking pieces (text extraction, HubSpot SDK
+    # calls), so they don't stall the event loop and pile up unbounded
+    # threads. Reusing connections to api.hubapi.com skips the TCP+TLS
+    # handshake on every upload.
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        timeout=30.0,
+        headers={"Authorization": _HUBSPOT_BEARER},
+        limits=httpx.Limits(max_keepalive_connections=32),
+    )
+    app.state.blocking_limiter = anyio.CapacityLimiter(16)
+    # PDFium has no internal locking and pypdfium2 adds none, so every
+    # in-process pdfium call shares this single slot; only the process
+    # pool (one single-threaded pdfium per child) runs them in parallel.
+    app.state.pdfium_limiter = anyio.CapacityLimiter(1)
+    # One pool per gunicorn worker, so bound it: a document is split into
+    # at most PDF_PARALLEL_CHUNKS ranges, and with N web workers (export
+    # WEB_CONCURRENCY to match -w) each gets its share of the cores
+    # instead of nproc children apiece.
+    pool_workers = min(
+        PDF_PARALLEL_CHUNKS,
+        max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1"))),
+    )
+    app.state.process_pool = ProcessPoolExecutor(max_workers=pool_workers)
+    # Per-worker client setup. This runs after gunicorn forks, so with
+    # --preload no sockets or auth state are shared across workers.
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    model = await run_blocking(build_gemini_model)
+    gemini_batcher.model = model
+    hubspot_client = HubSpot(access_token=HUBSPOT_TOKEN)
+    gemini_batcher.start()
+    hubspot_batcher.start()
+    # Warm the skills cache once so the steady state needs no property
+    # round-trips at all (see sync_skills_property).
+    prop = await run_blocking(
+        hubspot_client.crm.properties.core_api.get_by_name,
+        object_type="contacts", property_name="skills"
+    )
+    app.state.known_skills = {opt.value for opt in prop.options}
+    app.state.skills_lock = asyncio.Lock()
+    cache_refresher = asyncio.create_task(refresh_gemini_cache())
+    yield
+    cache_refresher.cancel()
+    await hubspot_batcher.stop()
+    await gemini_batcher.stop()
+    app.state.process_pool.shutdown()
+    await app.state.http.aclose()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call in the shared thread pool without blocking the loop."""
+    return await anyio.to_thread.run_sync(
+        partial(func, *args, **kwargs), limiter=app.state.blocking_limiter
+    )
+
+async def run_pdfium(func, *args):
+    """Run a pdfium call on a worker thread, serialized (PDFium isn't thread-safe)."""
+    return await anyio.to_thread.run_sync(
+        partial(func, *args), limiter=app.state.pdfium_limiter
+    )
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,15 +307,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-#hubspot token
+#hubspot token, read once; the lifespan fails fast if it's missing
 HUBSPOT_TOKEN = os.getenv("HUBSPOT_TOKEN")
+_HUBSPOT_BEARER = f"Bearer {HUBSPOT_TOKEN}"
 
 # Initialize Gemini client
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 MODEL = "gemini-2.5-flash"
-model = genai.GenerativeModel(model_name=MODEL)
-hubspot_client = HubSpot(access_token=os.getenv("HUBSPOT_TOKEN"))
-FOLDER_ID="249026326717"
+GEMINI_CACHE_TTL_SECONDS = 3600
 
 # Improved prompt: prevents Gemini from wrapping response in code blocks
 RESUME_PROMPT = """
@@ -58,25 +333,103 @@ You are a resume parser. Extract the following fields from the resume text below
 Resume Text:
 """
 
-def extract_text_from_pdf(file_bytes):
-    text = ""
-    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-        for page in pdf.pages:
-            text += page.extract_text() or ""
-    return text
+def build_gemini_model():
+    """Build the parsing model, preferring an explicit context cache.
+
+    RESUME_PROMPT is identical on every call, so register it once as cached
+    content and reference it by name instead of re-sending (and re-billing)
+    the prefix per request. Context caching enforces a minimum prefix size,
+    so fall back to a plain model with the prompt as system instruction if
+    the create is rejected.
+    """
+    try:
+        cached = genai.caching.CachedContent.create(
+            model=MODEL,
+            system_instruction=RESUME_PROMPT,
+            ttl=timedelta(seconds=GEMINI_CACHE_TTL_SECONDS),
+        )
+        return genai.GenerativeModel.from_cached_content(cached_content=cached)
+    except Exception as e:
+        print(f"Gemini context cache unavailable, using uncached model: {e}")
+        return genai.GenerativeModel(model_name=MODEL, system_instruction=RESUME_PROMPT)
+
+# Built per worker in the lifespan (after fork, see above)
+model = None
+gemini_batcher = GeminiBatcher(model)
+
+async def refresh_gemini_cache():
+    """Rebuild the cached content shortly before its TTL runs out."""
+    global model
+    while True:
+        await asyncio.sleep(GEMINI_CACHE_TTL_SECONDS * 0.9)
+        model = await run_blocking(build_gemini_model)
+        gemini_batcher.model = model
+
+hubspot_client = None  # built per worker in the lifespan
+hubspot_batcher = HubspotBatcher()
+FOLDER_ID="249026326717"
+
+# Fallback cleanup for fenced model output (```json ... ```)
+_FENCE_RE = re.compile(r"(?:^```(?:json)?\s*)|(?:\s*```$)")
+
+# Below this many pages, process fan-out costs more than it saves
+PDF_PARALLEL_THRESHOLD = 8
+PDF_PARALLEL_CHUNKS = 4
+
+def _pdf_page_count(file_bytes):
+    pdf = pdfium.PdfDocument(file_bytes)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+def _extract_pdf_range(file_bytes, start, end):
+    """Extract text from pages [start, end); also runs in pool workers."""
+    pdf = pdfium.PdfDocument(file_bytes)
+    try:
+        parts = []
+        for index in range(start, end):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return "".join(parts)
+    finally:
+        pdf.close()
+
+async def extract_text_from_pdf(file_bytes):
+    """Extract PDF text, fanning long documents out over the process pool.
+
+    The page count is read cheaply up front: short resumes stay on one
+    worker thread, while documents with PDF_PARALLEL_THRESHOLD+ pages are
+    split into contiguous ranges extracted by child processes in parallel.
+    """
+    n_pages = await run_pdfium(_pdf_page_count, file_bytes)
+    if n_pages < PDF_PARALLEL_THRESHOLD:
+        return await run_pdfium(_extract_pdf_range, file_bytes, 0, n_pages)
+    loop = asyncio.get_running_loop()
+    chunks = min(PDF_PARALLEL_CHUNKS, n_pages)
+    bounds = [
+        (i * n_pages // chunks, (i + 1) * n_pages // chunks)
+        for i in range(chunks)
+    ]
+    parts = await asyncio.gather(*[
+        loop.run_in_executor(
+            app.state.process_pool, _extract_pdf_range, file_bytes, start, end
+        )
+        for start, end in bounds
+    ])
+    return "".join(parts)
 
 def extract_text_from_docx(file_bytes):
-    with NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-        tmp.write(file_bytes)
-        tmp.flush()
-        doc = Document(tmp.name)
-    return "\n".join([p.text for p in doc.paragraphs if p.text.strip()])
+    # Document accepts a file-like object, so no tempfile round-trip needed
+    doc = Document(io.BytesIO(file_bytes))
+    return "\n".join(p.text for p in doc.paragraphs if p.text.strip())
 
-def upload_bytes_to_hs(data: bytes, filename: str, folder_id: str) -> str:
+async def upload_file_to_hs(fileobj, filename: str, folder_id: str) -> str:
+    """Upload to HubSpot Files, streaming from a file-like object."""
     url = "https://api.hubapi.com/files/v3/files"
-    headers = {
-        "Authorization": f"Bearer {os.getenv('HUBSPOT_TOKEN')}"
-    }
 
     options = {
         "access": "PRIVATE",
@@ -84,20 +437,20 @@ def upload_bytes_to_hs(data: bytes, filename: str, folder_id: str) -> str:
     }
 
     files = {
-        "file": (filename, io.BytesIO(data)),
+        "file": (filename, fileobj, "application/octet-stream"),
         "fileName": (None, filename),
         "folderId": (None, folder_id),
         "access": (None, "PRIVATE"),
         "overwrite": (None, "false"),
-        "options": (None, json.dumps(options), "application/json")
+        "options": (None, orjson.dumps(options).decode(), "application/json")
     }
 
-    resp = requests.post(url, headers=headers, files=files)
+    resp = await app.state.http.post(url, files=files)
     print(resp)
 
     try:
         resp.raise_for_status()
-    except requests.HTTPError:
+    except httpx.HTTPStatusError:
         raise HTTPException(status_code=resp.status_code, detail=f"HubSpot upload failed: {resp.text}")
 
     file_url = resp.json().get("url")
@@ -106,8 +459,53 @@ def upload_bytes_to_hs(data: bytes, filename: str, folder_id: str) -> str:
 
     return file_url
 
+async def sync_skills_property(new_skills: set):
+    """Grow the HubSpot skills enumeration with values we haven't seen yet.
+
+    Serialized behind a lock so concurrent requests adding skills at the
+    same time collapse into sequential updates; the re-check inside the
+    lock means followers whose skills were already pushed skip the write.
+    """
+    async with app.state.skills_lock:
+        new = new_skills - app.state.known_skills
+        if not new:
+            return
+        # update() replaces the whole options list, and other workers (or
+        # any other writer) may have grown the enumeration since our
+        # startup snapshot - re-fetch on this rare path and merge the live
+        # options first, so a stale cache never clobbers their additions.
+        prop = await run_blocking(
+            hubspot_client.crm.properties.core_api.get_by_name,
+            object_type="contacts", property_name="skills"
+        )
+        app.state.known_skills |= {opt.value for opt in prop.options}
+        new = new_skills - app.state.known_skills
+        if not new:
+            return
+        # Only here, in the rare new-skill case, is the full options list
+        # ever materialized; the SDK model needs a concrete list to
+        # serialize, so that one allocation stays.
+        update_prop = PropertyCreate(
+            name="skills",
+            label="Skills",
+            group_name="contactinformation",
+            type="enumeration",
+            field_type="checkbox",
+            options=[
+                {"label": v, "value": v}
+                for v in sorted(app.state.known_skills | new)
+            ]
+        )
+        await run_blocking(
+            hubspot_client.crm.properties.core_api.update,
+            object_type="contacts",
+            property_name="skills",
+            property_update=update_prop
+        )
+        app.state.known_skills |= new
+
 @app.post("/parse_resume/")
-async def parse_resume(file: UploadFile = File(...)):
+async def parse_resume(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
     data = await file.read()
     content_type = file.content_type
     text = ""
@@ -115,12 +513,12 @@ async def parse_resume(file: UploadFile = File(...)):
     #text extraction
     try:
         if content_type == "application/pdf":
-            text = extract_text_from_pdf(data)
+            text = await extract_text_from_pdf(data)
         elif content_type in [
             "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
             "application/msword"
         ]:
-            text = extract_text_from_docx(data)
+            text = await run_blocking(extract_text_from_docx, data)
         else:
             raise HTTPException(status_code=400, detail="Unsupported file format.")
     except Exception as e:
@@ -128,21 +526,31 @@ async def parse_resume(file: UploadFile = File(...)):
 
     if not text.strip():
         raise HTTPException(status_code=400, detail="No text extracted from the file.")
-    
-    #file upload to hubspot
-    try:
-        file_url = upload_bytes_to_hs(data, file.filename,FOLDER_ID)
-        # print("Upload Complete",file_url)
-    except Exception as e:
-        raise HTTPException(500, f"File upload failed: {e}")
 
-    # Compose prompt
-    prompt = RESUME_PROMPT + "\n\n" + text
+    # Plausibility gate before spending Gemini tokens: under ~200 chars is
+    # extraction garbage rather than a resume; for oversized dumps keep the
+    # head (contact info) and tail (most recent roles) only.
+    if len(text) < 200:
+        raise HTTPException(status_code=400, detail="Extracted text is too short to be a resume.")
+    if len(text) > 30_000:
+        text = text[:15_000] + "\n...\n" + text[-5_000:]
+    
+    #file upload to hubspot, started now so it overlaps the Gemini call;
+    #the URL is only needed once we write the contact. It streams from the
+    #spooled upload file (extraction is done with it), and the in-memory
+    #copy is dropped before the long model await so N concurrent resumes
+    #don't each keep a full file resident.
+    file.file.seek(0)
+    del data
+    file_url_task = asyncio.create_task(
+        upload_file_to_hs(file.file, file.filename, FOLDER_ID)
+    )
 
     try:
-        # Send to Gemini
-        response = model.generate_content(
-            prompt,
+        # Send to Gemini; RESUME_PROMPT rides along as cached content /
+        # system instruction, so only the resume text goes over the wire.
+        response = await gemini_batcher.submit(
+            text,
             generation_config={
                 "temperature": 0.1,
                 "response_mime_type": "application/json"
@@ -152,95 +560,54 @@ async def parse_resume(file: UploadFile = File(...)):
         # print(response)
 
         raw = response.text.strip()
-        # safe cleanup
-        raw = re.sub(r"^```(?:json)?\s*", "", raw)
-        raw = re.sub(r"\s*```$", "", raw)
-        parsed = json.loads(raw)
+        try:
+            parsed = orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            # response_mime_type="application/json" should rule out code
+            # fences, but strip them if a wrapped response sneaks through
+            parsed = orjson.loads(_FENCE_RE.sub("", raw))
 
         name = parsed.get("name", "").strip()
         parts = name.split()
         firstname = parts[0] if parts else ""
         lastname = " ".join(parts[1:]) if len(parts) > 1 else ""
 
-        #skills setup
-        prop = hubspot_client.crm.properties.core_api.get_by_name(
-            object_type="contacts", property_name="skills"
-        )
-
-        # print(existing)
-
-        existing = {opt.value for opt in prop.options}
+        #skills: only touch the HubSpot property when this resume introduces
+        #values the cache hasn't seen (warmed once in the lifespan); the
+        #update isn't needed for the response, so it runs after we return
         incoming = set(parsed.get("skills", []))
-
-        # Always defined
-        combined = existing.union(incoming)
-
-        print(combined)
-
-        opts_payload = [{"label": v, "value": v} for v in sorted(combined)]
-
-        update_prop = PropertyCreate(
-            name="skills",
-            label="Skills",
-            group_name="contactinformation",
-            type="enumeration",
-            field_type="checkbox",
-            options=opts_payload
-        )
-        response = hubspot_client.crm.properties.core_api.update(
-            object_type="contacts",
-            property_name="skills",
-            property_update=update_prop
-        )
-
-        # print(response)
-
-        selected = incoming
-        skills_str = ";".join(selected)
-
-        email = parsed["email"]
-
-        req = PublicObjectSearchRequest(
-            filter_groups=[FilterGroup(filters=[Filter(property_name="email", operator="EQ", value=email)])],
-            properties=["email"], limit=1
-        )
-
-        search_res = hubspot_client.crm.contacts.search_api.do_search(public_object_search_request=req)
-        if search_res.results:
-            # Update
-            contact_id = search_res.results[0].id
-            hubspot_client.crm.contacts.basic_api.update(
-                contact_id,
-                simple_public_object_input=SimplePublicObjectInput(
-                    properties={
-                        "firstname": firstname,
-                        "lastname": lastname,
-                        "phone": parsed["phone"],
-                        "jobtitle": parsed["job_title"],
-                        "company": parsed["company"],
-                        "skills": skills_str,
-                        "resume_file_url": file_url
-                    }
-                )
-            )
-        else:
-            # Create
-            in_props = {
-                "firstname": firstname,
-                "lastname": lastname,
-                "email": email,
-                "phone": parsed["phone"],
-                "jobtitle": parsed["job_title"],
-                "company": parsed["company"],
-                "skills": skills_str,
-                "resume_file_url": file_url
-            }
-            hs_obj = hubspot_client.crm.contacts.basic_api.create(
-                simple_public_object_input_for_create=SimplePublicObjectInputForCreate(properties=in_props)
-            )
-            contact_id = hs_obj.id
-
-        return JSONResponse(content=parsed)
+        new_skills = incoming - app.state.known_skills
+        if new_skills:
+            background_tasks.add_task(sync_skills_property, new_skills)
+
+        skills_str = ";".join(incoming)
+
+        # Keep garbage out of the shared batch: an empty or bogus email
+        # would make HubSpot reject the whole flush, not just this resume.
+        email = parsed.get("email", "").strip().lower()
+        if not email or "@" not in email:
+            raise HTTPException(status_code=400, detail="No valid email address found in the resume.")
+
+        try:
+            file_url = await file_url_task
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(500, f"File upload failed: {e}")
+
+        # Upsert through the batcher: one batch read/update/create round-trip
+        # is shared by every resume that lands in the same flush window.
+        contact_id = await hubspot_batcher.submit(email, {
+            "firstname": firstname,
+            "lastname": lastname,
+            "phone": parsed["phone"],
+            "jobtitle": parsed["job_title"],
+            "company": parsed["company"],
+            "skills": skills_str,
+            "resume_file_url": file_url
+        })
+
+        return ORJSONResponse(parsed)
 
 
         # contact_input = SimplePublicObjectInputForCreate(
@@ -277,8 +644,13 @@ async def parse_resume(file: UploadFile = File(...)):
 
         # return JSONResponse(content=parsed)
 
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         raise HTTPException(status_code=500, detail="Gemini returned invalid JSON.")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI parsing failed: {str(e)}")
+    finally:
+        if not file_url_task.done():
+            file_url_task.cancel()
     
\ No newline at end of file
@@ -0,0 +1,13 @@
+"""Smoke test: the app module must import and build the FastAPI app.
+
+Catches SDK symbol renames and other import-time breakage without
+needing live Gemini/HubSpot credentials (all clients are built in the
+lifespan, not at import).
+"""
+
+def test_app_imports_and_registers_route():
+    import main
+    assert any(
+        getattr(route, "path", None) == "/parse_resume/"
+        for route in main.app.routes
+    )